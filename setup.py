@@ -51,6 +51,7 @@ setup(name="trollimage",
       extras_require={
           'geotiff': ['rasterio'],
           'xarray': ['xarray', 'dask[array]'],
+          'numba': ['numba'],
       },
       tests_require=['xarray', 'dask[array]'],
       )
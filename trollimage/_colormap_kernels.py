@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2021 Pytroll Developers
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Compiled kernels for the colormap module.
+
+This module needs numba, and fails to import if numba isn't available. The
+formulas are the same as in :mod:`trollimage.colorspaces`, inlined so that
+each pixel is interpolated and converted in one go. Nothing is compiled at
+import, :func:`warm_up` compiles the kernel for the default output type.
+"""
+
+import math
+
+import numpy as np
+from numba import njit, prange
+
+# Fast math without the 'nnan' and 'ninf' flags, since NaNs mark invalid data
+# and have to be propagated, and without 'reassoc', which turns the exact
+# zeros of black into tiny negative numbers.
+FASTMATH_FLAGS = {'nsz', 'arcp', 'contract', 'afn'}
+
+
+@njit(fastmath=FASTMATH_FLAGS, cache=True)
+def _lab_f_inv(arr):
+    if arr > 6.0 / 29.0:
+        return arr ** 3
+    return 3 * (6.0 / 29.0) * (6.0 / 29.0) * (arr - 4.0 / 29.0)
+
+
+@njit(fastmath=FASTMATH_FLAGS, cache=True)
+def _srgb_f_inv(arr):
+    if arr > 0.0031308:
+        return 1.055 * (arr ** (1.0 / 2.4)) - 0.055
+    return 12.92 * arr
+
+
+@njit(fastmath=FASTMATH_FLAGS, cache=True)
+def _scale(value, scale):
+    """Scale *value* from 0-1 to 0-*scale* and round it, unless *scale* is 0."""
+    if scale == 0:
+        return value
+    # NaNs are scaled to 0
+    if not value > 0:
+        return 0.0
+    if value > 1:
+        return scale
+    return np.rint(value * scale)
+
+
+@njit(parallel=True, fastmath=FASTMATH_FLAGS, cache=True)
+def interp_hcl(flat, xp, fp_hcl, fp_alpha, out, scale=0.0):
+    """Interpolate the HCL and alpha colors at *flat* and convert them to RGB(A).
+
+    Args:
+        flat (numpy array): one dimensional data to colorize.
+        xp (numpy array): increasing control points of the colormap.
+        fp_hcl (numpy array): HCL colors of the colormap, shape (N, 3).
+        fp_alpha (numpy array): alpha values of the colormap, shape (N, 0) or (N, 1).
+        out (numpy array): output array of shape (3 + number of alpha channels, flat.size).
+        scale (float): if not 0, the colors are clipped to 0-1, scaled to
+            0-*scale* and rounded, for integer outputs.
+
+    """
+    num_alpha = fp_alpha.shape[1]
+    last = xp.size - 1
+    for i in prange(flat.size):
+        x__ = flat[i]
+        low = 0
+        high = last
+        while high - low > 1:
+            mid = (low + high) >> 1
+            if xp[mid] <= x__:
+                low = mid
+            else:
+                high = mid
+        step = xp[high] - xp[low]
+        if step > 0:
+            weight = (x__ - xp[low]) / step
+            if weight < 0:
+                weight = 0.0
+            elif weight > 1:
+                weight = 1.0
+        elif x__ >= xp[high]:
+            weight = 1.0
+        else:
+            weight = 0.0
+
+        h__ = fp_hcl[low, 0] + weight * (fp_hcl[high, 0] - fp_hcl[low, 0])
+        c__ = fp_hcl[low, 1] + weight * (fp_hcl[high, 1] - fp_hcl[low, 1])
+        l__ = fp_hcl[low, 2] + weight * (fp_hcl[high, 2] - fp_hcl[low, 2])
+
+        # hcl2lab
+        angle = math.pi / 3.0 - math.radians(h__)
+        r__ = (l__ * 311 + 125) * c__
+        new_l = (l__ * 61 + 9 + 16.0) / 116.0
+        # lab2xyz
+        x2_ = 0.95047 * _lab_f_inv(new_l + math.sin(angle) * r__ / 500.0)
+        y2_ = _lab_f_inv(new_l)
+        z2_ = 1.08883 * _lab_f_inv(new_l - math.cos(angle) * r__ / 200.0)
+        # xyz2rgb
+        out[0, i] = _scale(_srgb_f_inv(x2_ * 3.2406 + y2_ * -1.5372 + z2_ * -0.4986) * 255, scale)
+        out[1, i] = _scale(_srgb_f_inv(x2_ * -0.9689 + y2_ * 1.8758 + z2_ * 0.0415) * 255, scale)
+        out[2, i] = _scale(_srgb_f_inv(x2_ * 0.0557 + y2_ * -0.2040 + z2_ * 1.0570) * 255, scale)
+
+        for j in range(num_alpha):
+            out[3 + j, i] = _scale(fp_alpha[low, j] + weight * (fp_alpha[high, j] - fp_alpha[low, j]), scale)
+
+
+def warm_up():
+    """Compile the kernel for the default output type, so that the first colorization doesn't have to."""
+    xp = np.array([0.0, 1.0])
+    fp = np.zeros((2, 3))
+    # the HCL colors are cached as read-only arrays
+    fp.flags.writeable = False
+    for data_type in (np.float32, np.float64):
+        interp_hcl(np.zeros(1, dtype=data_type), xp, fp, np.zeros((2, 0)), np.empty((3, 1), dtype=np.float32), 0.0)
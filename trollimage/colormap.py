@@ -22,13 +22,16 @@
 
 """A simple colormap module."""
 
+import os
 import warnings
+from collections import namedtuple
+from functools import lru_cache
 
 import numpy as np
 from trollimage.colorspaces import rgb2hcl, hcl2rgb
 
 
-def colorize(arr, colors, values):
+def colorize(arr, colors, values, dtype=np.float32, channel_chunks=None):
     """Colorize a monochromatic array *arr*, based *colors* given for *values*.
 
     Interpolation is used. *values* must be in ascending order.
@@ -40,11 +43,37 @@ def colorize(arr, colors, values):
             the colors to use (R, G, B)
         values (numpy array):
             the values corresponding to the colors in the array
+        dtype (numpy dtype):
+            type of the colorized array. Floating point types give colors
+            between 0 and 1, integer types give colors scaled to their
+            maximum, e.g. 0 to 255 for uint8. The interpolation itself is
+            done in double precision.
+        channel_chunks (int):
+            chunk size of the channel dimension of colorized dask arrays,
+            at least 1. By default all the channels are in one chunk. The
+            channels are split by rechunking the colorized array, which adds
+            tasks to the graph. It is not used for other arrays.
     """
+    if channel_chunks is not None and channel_chunks < 1:
+        raise ValueError(f"'channel_chunks' must be at least 1. Got {channel_chunks}.")
+    return _colorize_with_compiled(arr, _compile_colormap(colors, values, dtype), channel_chunks)
+
+
+def colorize_u8(arr, colors, values, channel_chunks=None):
+    """Colorize a monochromatic array *arr* to 8-bit colors between 0 and 255.
+
+    This is :func:`colorize` with a uint8 *dtype*: the colors are clipped to
+    0-1, scaled and rounded while they are interpolated, and NaNs give 0.
+    """
+    return colorize(arr, colors, values, dtype=np.uint8, channel_chunks=channel_chunks)
+
+
+def _colorize_with_compiled(arr, compiled, channel_chunks=None):
+    """Colorize *arr* with a prepared colormap."""
     if can_be_block_mapped(arr):
-        return _colorize_dask(arr, colors, values)
+        return _colorize_dask(arr, compiled, channel_chunks)
     else:
-        return _colorize(arr, colors, values)
+        return _colorize_compiled(arr, compiled)
 
 
 def can_be_block_mapped(data):
@@ -52,59 +81,191 @@ def can_be_block_mapped(data):
     return hasattr(data, 'map_blocks')
 
 
-def _colorize_dask(dask_array, colors, values):
+# Colormap prepared for colorizing, computed once and shared by all the blocks
+# of a dask array. The values and alpha are contiguous float64 arrays, and the
+# palette stacks the HCL colors and alpha. The scale is the maximum of integer
+# output types, 0 for floating point outputs.
+_CompiledColormap = namedtuple('_CompiledColormap', ['xp', 'hcl', 'alpha', 'palette', 'dtype', 'scale'])
+
+
+def _compile_colormap(colors, values, dtype=np.float32):
+    """Prepare the colormap for colorizing to *dtype*."""
+    hcl_colors = _convert_rgb_list_to_hcl(colors)
+    alpha = np.ascontiguousarray(np.asarray(colors)[:, 3:], dtype=np.float64)
+    return _CompiledColormap(xp=np.ascontiguousarray(values, dtype=np.float64),
+                             hcl=hcl_colors,
+                             alpha=alpha,
+                             palette=np.concatenate((hcl_colors, alpha), axis=1),
+                             dtype=dtype,
+                             scale=float(np.iinfo(dtype).max) if np.issubdtype(dtype, np.integer) else 0.0)
+
+
+def _colorize_dask(dask_array, compiled, channel_chunks=None):
     """Colorize a dask array.
 
-    The channels are stacked on the first dimension.
+    The channels are stacked on the first dimension. Each block is colorized
+    for all the channels at once, the channels are split afterwards by an
+    extra rechunk step if *channel_chunks* is smaller than the number of
+    channels.
     """
-    return dask_array.map_blocks(_colorize, colors, values, dtype=colors.dtype, new_axis=0,
-                                 chunks=[colors.shape[1]] + list(dask_array.chunks))
+    num_channels = compiled.palette.shape[1]
+    colorized = dask_array.map_blocks(_colorize_compiled, dtype=compiled.dtype, new_axis=0,
+                                      chunks=((num_channels,),) + dask_array.chunks,
+                                      compiled=compiled)
+    if channel_chunks is not None and channel_chunks < num_channels:
+        colorized = colorized.rechunk({0: channel_chunks})
+    return colorized
 
 
-def _colorize(arr, colors, values):
-    """Colorize the array."""
-    channels = _interpolate_rgb_colors(arr, colors, values)
-    alpha = _interpolate_alpha(arr, colors, values)
-    channels.extend(alpha)
-    channels = _mask_channels(channels, arr)
-    return np.stack(channels, axis=0)
+def _colorize_compiled(arr, compiled):
+    """Colorize the array with a prepared colormap."""
+    colorized = _interpolate_colors(arr, compiled)
+    if np.ma.isMaskedArray(arr):
+        return _mask_channels(colorized, arr)
+    return colorized
 
 
-def _interpolate_rgb_colors(arr, colors, values):
-    hcl_colors = _convert_rgb_list_to_hcl(colors)
-    channels = [np.interp(arr,
-                          np.array(values),
-                          np.array(hcl_colors)[:, i])
-                for i in range(3)]
-    channels = list(hcl2rgb(*channels))
-    return channels
+def _interpolate_colors(arr, compiled):
+    """Interpolate the colors for *arr* in HCL space, alpha included.
+
+    The position of the data in the values is searched only once and shared
+    by all the channels. The channels are stacked on the first dimension.
+    """
+    order = _get_flat_order(arr)
+    flat = np.asarray(arr).ravel(order=order)
+    interp_hcl = _get_interp_hcl()
+    if interp_hcl is not None and _is_compiled_output_type(compiled.dtype):
+        colorized = _interpolate_colors_compiled(interp_hcl, flat, compiled)
+    else:
+        colorized = _interpolate_colors_blockwise(flat, compiled)
+    return colorized.reshape((-1,) + np.shape(arr), order=order)
+
+
+def _get_flat_order(arr):
+    """Get the order in which *arr* can be flattened without a copy.
+
+    This is 'F' for Fortran contiguous arrays (e.g. transposed arrays) and
+    'C' otherwise.
+    """
+    flags = np.asarray(arr).flags
+    return 'F' if flags.f_contiguous and not flags.c_contiguous else 'C'
+
+
+@lru_cache(maxsize=None)
+def _get_interp_hcl():
+    """Get the numba colorizing kernel, compiled on first use.
+
+    None is returned if numba isn't installed, if the kernel is disabled by
+    setting the ``TROLLIMAGE_DISABLE_NUMBA`` environment variable, or if it
+    can't be compiled, in which case the numpy implementation is used.
+    """
+    if os.environ.get('TROLLIMAGE_DISABLE_NUMBA', '').lower() not in ('', '0', 'false', 'no'):
+        return None
+    try:
+        from trollimage._colormap_kernels import interp_hcl, warm_up
+    except ImportError:
+        return None
+    try:
+        warm_up()
+    except Exception as err:
+        warnings.warn(f"Can't compile the numba colorizing kernel, falling back to numpy: {err}")
+        return None
+    return interp_hcl
+
+
+def _is_compiled_output_type(dtype):
+    """Check if the numba kernel can colorize to *dtype*: integers, single or double precision floats."""
+    dtype = np.dtype(dtype)
+    return np.issubdtype(dtype, np.integer) or dtype in (np.float32, np.float64)
+
+
+def _interpolate_colors_compiled(interp_hcl, flat, compiled):
+    """Interpolate the colors with the numba kernel *interp_hcl*, using all the available cores."""
+    if not np.issubdtype(flat.dtype, np.floating) or flat.dtype.itemsize < 4:
+        flat = flat.astype(np.float64)
+    out = np.empty((compiled.palette.shape[1], flat.size), dtype=compiled.dtype)
+    interp_hcl(flat, compiled.xp, compiled.hcl, compiled.alpha, out, compiled.scale)
+    return out
+
+
+# Number of elements interpolated at once by numpy, so that the temporary
+# arrays of the HCL to RGB conversion stay small enough for the CPU caches.
+NUMPY_BLOCK_SIZE = 65536
+
+
+def _interpolate_colors_blockwise(flat, compiled):
+    """Interpolate the colors with numpy, one block of data at a time."""
+    out = np.empty((compiled.palette.shape[1], flat.size), dtype=compiled.dtype)
+    for start in range(0, flat.size, NUMPY_BLOCK_SIZE):
+        block = slice(start, start + NUMPY_BLOCK_SIZE)
+        interpolated = _interpolate_columns(flat[block], compiled.xp, compiled.palette)
+        rgb = hcl2rgb(interpolated[:, 0], interpolated[:, 1], interpolated[:, 2])
+        for i, channel in enumerate(rgb):
+            out[i, block] = _scale_channel(channel, compiled.scale)
+        out[3:, block] = _scale_channel(interpolated[:, 3:].T, compiled.scale)
+    return out
+
+
+def _scale_channel(channel, scale):
+    """Scale *channel* from 0-1 to 0-*scale* and round it, unless *scale* is 0."""
+    if not scale:
+        return channel
+    # fmax first, so that NaNs are scaled to 0
+    channel = np.fmin(np.fmax(channel, 0), 1)
+    return np.rint(channel * scale)
+
+
+def _interpolate_columns(flat, xp, fp):
+    """Interpolate linearly all the columns of *fp* at the points *flat*.
+
+    This is equivalent to calling :func:`numpy.interp` on each column of *fp*,
+    but the binary search of *flat* in *xp* is done only once.
+    """
+    if len(xp) == 1:
+        return np.repeat(fp, flat.size, axis=0)
+    if len(xp) == 2 and xp[1] > xp[0]:
+        # a simple gradient, no search needed
+        weights = np.clip((flat - xp[0]) / (xp[1] - xp[0]), 0, 1)
+        return fp[0] + weights[:, np.newaxis] * (fp[1] - fp[0])
+    # searching the inner points only gives indices already in [0, len(xp) - 2]
+    idx = np.searchsorted(xp[1:-1], flat, side='right')
+    x_0 = xp[idx]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        weights = np.clip((flat - x_0) / (xp[idx + 1] - x_0), 0, 1)
+    if xp[-1] == xp[-2]:
+        weights[flat == xp[-1]] = 1
+    return fp[idx] + weights[:, np.newaxis] * np.diff(fp, axis=0)[idx]
 
 
 def _convert_rgb_list_to_hcl(colors):
-    hcl_colors = np.array([rgb2hcl(*i[:3]) for i in colors])
+    """Convert the colors to HCL.
+
+    The conversion is cached, the returned array is read-only.
+    """
+    colors = np.asarray(colors)
+    return _convert_rgb_bytes_to_hcl(colors.shape, colors.dtype.str, colors.tobytes())
+
+
+@lru_cache(maxsize=64)
+def _convert_rgb_bytes_to_hcl(shape, dtype, buffer):
+    colors = np.frombuffer(buffer, dtype=dtype).reshape(shape)
+    hcl_colors = np.stack(rgb2hcl(colors[:, 0], colors[:, 1], colors[:, 2]), axis=1)
     _unwrap_colors_in_hcl_space(hcl_colors)
+    hcl_colors.flags.writeable = False
     return hcl_colors
 
 
 def _unwrap_colors_in_hcl_space(hcl_colors):
-    hcl_colors[:, 0] = np.rad2deg(np.unwrap(np.deg2rad(np.array(hcl_colors)[:, 0])))
-
-
-def _interpolate_alpha(arr, colors, values):
-    alpha = [np.interp(arr,
-                       np.array(values),
-                       np.array(colors)[:, i + 3])
-             for i in range(np.array(colors).shape[1] - 3)]
-    return alpha
+    hcl_colors[:, 0] = np.rad2deg(np.unwrap(np.deg2rad(hcl_colors[:, 0])))
 
 
 def _mask_channels(channels, arr):
-    """Mask the channels if arr is a masked array."""
-    try:
-        channels = [_mask_array(channel, arr) for channel in channels]
-    except AttributeError:
-        pass
-    return channels
+    """Mask the channels stacked on the first dimension if arr is a masked array."""
+    mask = np.ma.getmask(arr)
+    if mask is not np.ma.nomask:
+        # one writable mask for all the channels, not shared with arr
+        mask = np.broadcast_to(mask, channels.shape).copy()
+    return np.ma.array(channels, mask=mask, copy=False)
 
 
 def _mask_array(new_array, arr):
@@ -126,31 +287,75 @@ def palettize(arr, colors, values):
         values (numpy array):
             the values corresponding to the colors in the array
     """
+    step = _get_uniform_step(values)
     if can_be_block_mapped(arr):
-        return _palettize_dask(arr, colors, values), tuple(colors)
+        return _palettize_dask(arr, colors, values, step), tuple(colors)
     else:
-        return _palettize(arr, values), tuple(colors)
+        return _palettize(arr, values, step), tuple(colors)
 
 
-def _palettize_dask(darr, colors, values):
+def _palettize_dask(darr, colors, values, step=None):
     """Apply a palette to a dask array."""
-    return darr.map_blocks(_palettize, values, dtype=int)
+    dtype = _get_palette_index_dtype(values)
+    return darr.map_blocks(_palettize, values, step, dtype=dtype,
+                           meta=np.empty((0,) * darr.ndim, dtype=dtype))
 
 
-def _palettize(arr, values):
+def _palettize(arr, values, step=None):
     """Apply palette to array."""
-    new_arr = _digitize_array(arr, values)
-    reshaped_array = new_arr.reshape(arr.shape)
+    new_arr = _digitize_array(arr, values, step)
+    reshaped_array = new_arr.reshape(arr.shape, order=_get_flat_order(arr))
     return _mask_array(reshaped_array, arr)
 
 
-def _digitize_array(arr, values):
-    new_arr = np.digitize(arr.ravel(),
-                          np.concatenate((values,
-                                          [max(np.nanmax(arr),
-                                               values.max()) + 1])))
-    new_arr -= 1
-    new_arr = new_arr.clip(min=0, max=len(values) - 1)
+def _get_palette_index_dtype(values):
+    """Get the smallest unsigned integer type able to index the palette of *values*."""
+    if len(values) <= 256:
+        return np.uint8
+    if len(values) <= 65536:
+        return np.uint16
+    return np.intp
+
+
+def _get_uniform_step(values):
+    """Get the step between the *values* if they are evenly spaced, None otherwise."""
+    steps = np.diff(values)
+    if len(steps) == 0 or steps[0] <= 0 or not np.allclose(steps, steps[0], rtol=1e-9, atol=0):
+        return None
+    return steps[0]
+
+
+def _digitize_array(arr, values, step=None):
+    """Get the index of the interval of *values* each element of *arr* falls in.
+
+    Data outside of *values* is put in the first or last interval. If the
+    *values* are evenly spaced by *step*, the index is computed directly
+    instead of being searched for. The indices are of the smallest integer
+    type fitting the number of *values*.
+    """
+    flat = np.asarray(arr).ravel(order=_get_flat_order(arr))
+    dtype = _get_palette_index_dtype(values)
+    if step is not None:
+        return _digitize_uniform(flat, values, step, dtype)
+    # leaving out the first value puts the data below it in the first interval
+    # directly, without subtracting one and clipping
+    return np.searchsorted(values[1:], flat, side='right').astype(dtype, copy=False)
+
+
+def _digitize_uniform(flat, values, step, dtype=np.intp):
+    """Digitize *flat* in the evenly spaced *values*."""
+    # in floating point, so that integer data below the first value doesn't wrap around
+    position = np.subtract(flat, values[0], dtype=np.float64) / step
+    # fmin/fmax put NaNs in the last interval, like searchsorted does
+    np.fmin(position, len(values) - 1, out=position)
+    np.fmax(position, 0, out=position)
+    new_arr = position.astype(dtype)
+    # correct the rounding errors next to the edges of the intervals
+    lower_edges = values.astype(np.float64)
+    lower_edges[0] = np.nan
+    upper_edges = np.append(values[1:], np.nan)
+    new_arr -= lower_edges.take(new_arr) > flat
+    new_arr += upper_edges.take(new_arr) <= flat
     return new_arr
 
 
@@ -208,9 +413,16 @@ class Colormap(object):
             colors = colors.astype(np.float64)
         return colors
 
-    def colorize(self, data):
-        """Colorize a monochromatic array *data*, based on the current colormap."""
-        return colorize(data, self.colors, self.values)
+    def colorize(self, data, dtype=np.float32, channel_chunks=None):
+        """Colorize a monochromatic array *data*, based on the current colormap.
+
+        See :func:`colorize` for *dtype* and *channel_chunks*.
+        """
+        return colorize(data, self.colors, self.values, dtype=dtype, channel_chunks=channel_chunks)
+
+    def colorize_u8(self, data, channel_chunks=None):
+        """Colorize a monochromatic array *data* to 8-bit colors, see :func:`colorize_u8`."""
+        return self.colorize(data, dtype=np.uint8, channel_chunks=channel_chunks)
 
     def palettize(self, data):
         """Palettize a monochromatic array *data* based on the current colormap."""
@@ -254,41 +466,58 @@ class Colormap(object):
 
     def __add__(self, other):
         """Append colormap together."""
-        old, other = self._normalize_color_arrays(self, other)
-        values = np.concatenate((old.values, other.values))
+        values = np.concatenate((self.values, other.values))
         if not (np.diff(values) > 0).all():
             raise ValueError("Merged colormap 'values' are not monotonically "
                              "increasing.")
-        colors = np.concatenate((old.colors, other.colors))
+        colors = self._concatenate_colors(self.colors, other.colors)
         return Colormap(
             values=values,
             colors=colors,
         )
 
     @staticmethod
-    def _normalize_color_arrays(cmap1, cmap2):
-        num_bands1 = cmap1.colors.shape[-1]
-        num_bands2 = cmap2.colors.shape[-1]
-        if num_bands1 == num_bands2:
-            return cmap1, cmap2
-        return cmap1.to_rgba(), cmap2.to_rgba()
+    def _concatenate_colors(colors1, colors2):
+        """Concatenate the colors, making them all RGBA if one of them is.
+
+        The missing alpha of RGB colors is completely opaque (1.0).
+        """
+        num_colors1 = colors1.shape[0]
+        num_bands = max(colors1.shape[-1], colors2.shape[-1])
+        colors = np.empty((num_colors1 + colors2.shape[0], num_bands),
+                          dtype=np.result_type(colors1, colors2))
+        colors[:num_colors1, :colors1.shape[-1]] = colors1
+        colors[:num_colors1, colors1.shape[-1]:] = 1.0
+        colors[num_colors1:, :colors2.shape[-1]] = colors2
+        colors[num_colors1:, colors2.shape[-1]:] = 1.0
+        return colors
 
     def reverse(self):
-        """Reverse the current colormap in place."""
-        self.colors = np.flipud(self.colors)
+        """Reverse the current colormap in place.
+
+        The colors are reassigned to the values in reverse order, while the
+        values are kept so that they stay monotonically increasing. This mirrors
+        the colormap over its range only if the values are evenly spaced. The
+        reversed colors are a view of the previous ones, no copy is made.
+        """
+        self.colors = self.colors[::-1]
 
     def set_range(self, min_val, max_val):
         """Set the range of the colormap to [*min_val*, *max_val*]."""
         if min_val > max_val:
             max_val, min_val = min_val, max_val
-        self.values = (((self.values * 1.0 - self.values.min()) /
-                        (self.values.max() - self.values.min()))
+        values_min = self.values.min()
+        values_max = self.values.max()
+        self.values = (((self.values * 1.0 - values_min) /
+                        (values_max - values_min))
                        * (max_val - min_val) + min_val)
 
     def to_rio(self):
         """Convert the colormap to a rasterio colormap."""
-        colors = (((self.colors * 1.0 - self.colors.min()) /
-                   (self.colors.max() - self.colors.min())) * 255)
+        colors_min = self.colors.min()
+        colors_max = self.colors.max()
+        colors = (((self.colors * 1.0 - colors_min) /
+                   (colors_max - colors_min)) * 255)
         return dict(zip(self.values, tuple(map(tuple, colors))))
 
 
@@ -602,17 +831,16 @@ qualitative_colormaps = [set1, set2, set3,
 
 def colorbar(height, length, colormap):
     """Return the channels of a colorbar."""
-    cbar = np.tile(np.arange(length) * 1.0 / (length - 1), (height, 1))
-    cbar = (cbar * (colormap.values.max() - colormap.values.min())
-            + colormap.values.min())
+    cbar = np.linspace(colormap.values.min(), colormap.values.max(), length)
+    # all the rows are the same, so only one is colorized
+    channels = colormap.colorize(cbar)
 
-    return colormap.colorize(cbar)
+    return np.repeat(channels[:, np.newaxis, :], height, axis=1)
 
 
 def palettebar(height, length, colormap):
     """Return the channels of a palettebar."""
-    cbar = np.tile(np.arange(length) * 1.0 / (length - 1), (height, 1))
-    cbar = (cbar * (colormap.values.max() + 1 - colormap.values.min())
-            + colormap.values.min())
+    cbar = np.linspace(colormap.values.min(), colormap.values.max() + 1, length)
+    channel, palette = colormap.palettize(cbar)
 
-    return colormap.palettize(cbar)
+    return np.repeat(channel[np.newaxis, :], height, axis=0), palette
@@ -52,8 +52,9 @@ def xyz2lab(x__, y__, z__):
         """f__ function
         """
 
+        # both branches are computed, keep the power within its domain
         return np.where(arr > 216.0 / 24389.0,
-                        arr ** (1.0/3.0),
+                        np.maximum(arr, 216.0 / 24389.0) ** (1.0/3.0),
                         (1.0 / 3.0) * (29.0 / 6.0) * (29.0 / 6.0) * arr
                         + 4.0 / 29.0)
     fy_ = f__(y__ / 100.0)
@@ -96,7 +97,7 @@ def rgb2xyz(r__, g__, b__):
         """Forward
         """
         return np.where(arr > 0.04045,
-                        ((arr + 0.055) / 1.055) ** 2.4,
+                        ((np.maximum(arr, 0.04045) + 0.055) / 1.055) ** 2.4,
                         arr / 12.92)
 
 
@@ -125,7 +126,7 @@ def xyz2rgb(x__, y__, z__):
         """Inverse
         """
         return np.where(arr > 0.0031308,
-                        1.055 * (arr ** (1.0 / 2.4)) - 0.055,
+                        1.055 * (np.maximum(arr, 0.0031308) ** (1.0 / 2.4)) - 0.055,
                         12.92 * arr)
 
     return finv(r__) * 255, finv(g__) * 255, finv(b__) * 255
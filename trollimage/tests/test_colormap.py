@@ -125,7 +125,8 @@ class TestColormapClass(unittest.TestCase):
         self.assertTrue(np.allclose(channels.compute(), [[0, 1, 2, 3],
                                                          [0, 1, 2, 3],
                                                          [0, 1, 2, 3]]))
-        assert channels.dtype == int
+        assert channels.dtype == np.uint8
+        assert channels.compute().dtype == np.uint8
 
     def test_set_range(self):
         """Test set_range."""
@@ -358,3 +359,286 @@ class TestColormap:
         )
         new_cmap = cmap1 + cmap2
         assert new_cmap.values.shape[0] == colors1.shape[0] + colors2.shape[0]
+        num_bands = max(colors1.shape[-1], colors2.shape[-1])
+        assert new_cmap.colors.shape[-1] == num_bands
+        np.testing.assert_array_equal(new_cmap.colors[:colors1.shape[0], :colors1.shape[-1]], colors1)
+        np.testing.assert_array_equal(new_cmap.colors[colors1.shape[0]:, :colors2.shape[-1]], colors2)
+        if num_bands == 4:
+            expected_alpha = np.concatenate((colors1[:, 3] if colors1.shape[-1] == 4 else np.ones(colors1.shape[0]),
+                                             colors2[:, 3] if colors2.shape[-1] == 4 else np.ones(colors2.shape[0])))
+            np.testing.assert_array_equal(new_cmap.colors[:, 3], expected_alpha)
+
+    @pytest.mark.parametrize(
+        ('xp', 'fp'),
+        [
+            (np.array([1.0, 2.0, 4.0]), np.array([[0.0, 1.0], [1.0, 3.0], [0.5, 2.0]])),
+            (np.array([1.0, 2.0, 2.0]), np.array([[0.0, 1.0], [1.0, 3.0], [0.5, 2.0]])),
+            (np.array([3.0]), np.array([[0.2, 0.4]])),
+            (np.array([1.0, 4.0]), np.array([[0.0, 1.0], [1.0, 3.0]])),
+            (np.array([2.0, 2.0]), np.array([[0.0, 1.0], [1.0, 3.0]])),
+        ]
+    )
+    def test_interpolate_columns(self, xp, fp):
+        """Test that interpolating all the columns at once is like numpy's interp."""
+        flat = np.array([0.0, 1.0, 1.5, 2.0, 2.5, 3.0, 4.0, 5.0, np.nan])
+        res = colormap._interpolate_columns(flat, xp, fp)
+        for i in range(fp.shape[1]):
+            np.testing.assert_allclose(res[:, i], np.interp(flat, xp, fp[:, i]))
+
+    @pytest.mark.parametrize('colors', [COLORS_RGB1, COLORS_RGBA1])
+    def test_colorize_compiled_kernel(self, colors, monkeypatch):
+        """Test that the compiled kernel gives the same results as numpy."""
+        pytest.importorskip('numba')
+        values = np.linspace(0.2, 0.5, colors.shape[0])
+        data = np.array([[0.0, 0.2, 0.25, 0.3], [0.45, 0.5, 0.7, np.nan]])
+        res = colormap.colorize(data, colors, values)
+        monkeypatch.setattr(colormap, '_get_interp_hcl', lambda: None)
+        expected = colormap.colorize(data, colors, values)
+        np.testing.assert_allclose(res, expected, atol=1e-6)
+
+    @pytest.fixture
+    def fresh_kernel(self, monkeypatch):
+        """Get the numba kernel again in the test and after it, regardless of the environment."""
+        monkeypatch.delenv('TROLLIMAGE_DISABLE_NUMBA', raising=False)
+        colormap._get_interp_hcl.cache_clear()
+        yield
+        colormap._get_interp_hcl.cache_clear()
+
+    @pytest.mark.parametrize('value', ['1', 'true'])
+    def test_compiled_kernel_disabled(self, value, fresh_kernel, monkeypatch):
+        """Test that the compiled kernel can be disabled with an environment variable."""
+        monkeypatch.setenv('TROLLIMAGE_DISABLE_NUMBA', value)
+        assert colormap._get_interp_hcl() is None
+
+    def test_compiled_kernel_compile_error(self, fresh_kernel, monkeypatch):
+        """Test that numpy is used if the compiled kernel can't be compiled."""
+        pytest.importorskip('numba')
+        from trollimage import _colormap_kernels
+
+        def fail():
+            raise RuntimeError("no compiler")
+        monkeypatch.setattr(_colormap_kernels, 'warm_up', fail)
+        with pytest.warns(UserWarning, match="no compiler"):
+            assert colormap._get_interp_hcl() is None
+        res = colormap.colorize(np.array([0.2, 0.5]), COLORS_RGB1, np.linspace(0.2, 0.5, COLORS_RGB1.shape[0]))
+        np.testing.assert_allclose(res[:, 0], COLORS_RGB1[0], atol=1e-6)
+
+    def test_hcl_colors_cached(self):
+        """Test that the HCL colors are computed once per set of colors."""
+        hcl = colormap._convert_rgb_list_to_hcl(COLORS_RGB1)
+        assert colormap._convert_rgb_list_to_hcl(COLORS_RGB1.copy()) is hcl
+        assert not hcl.flags.writeable
+        colors = COLORS_RGB1.copy()
+        colors[1] = [1.0, 0.0, 0.0]
+        new_hcl = colormap._convert_rgb_list_to_hcl(colors)
+        assert new_hcl is not hcl
+        assert not np.allclose(new_hcl[1], hcl[1])
+
+    def test_colorize_changed_in_place(self):
+        """Test that colorizing uses the current colors and values, also after they are changed in place."""
+        cmap = colormap.Colormap(
+            values=np.linspace(0.2, 0.5, COLORS_RGBA1.shape[0]),
+            colors=COLORS_RGBA1.copy(),
+        )
+        data = np.array([0.0, 0.3, 0.6, 1.0])
+        cmap.colorize(data)
+        cmap.colorize_u8(data)
+        cmap.values[:] = np.linspace(0, 1, COLORS_RGBA1.shape[0])
+        cmap.colors[1] = [1.0, 0.0, 0.0, 0.5]
+        np.testing.assert_allclose(cmap.colorize(data), colormap.colorize(data, cmap.colors.copy(), cmap.values.copy()))
+        np.testing.assert_array_equal(cmap.colorize_u8(data),
+                                      colormap.colorize_u8(data, cmap.colors.copy(), cmap.values.copy()))
+
+    @pytest.mark.parametrize('values', [np.linspace(0, 1, 11), np.arange(8), np.linspace(-75, 30, 256)])
+    def test_digitize_uniform(self, values):
+        """Test that evenly spaced values are digitized like with a search."""
+        step = colormap._get_uniform_step(values)
+        assert step is not None
+        data = np.concatenate((values, np.nextafter(values, -np.inf), np.nextafter(values, np.inf),
+                               np.linspace(values[0] - 1, values[-1] + 1, 1000),
+                               [np.nan, np.inf, -np.inf]))
+        np.testing.assert_array_equal(colormap._digitize_array(data, values, step),
+                                      colormap._digitize_array(data, values))
+
+    @pytest.mark.parametrize(
+        ('values', 'data_type'),
+        [
+            (np.array([10, 20, 30, 40], dtype=np.uint8), np.uint8),
+            (np.array([100, 200, 300], dtype=np.uint16), np.uint16),
+            (np.array([-20, -10, 0, 10], dtype=np.int8), np.int8),
+            (np.array([-300, 0, 300], dtype=np.int16), np.int16),
+            (np.array([0.5, 1.5, 2.5]), np.uint8),
+        ]
+    )
+    def test_digitize_uniform_integers(self, values, data_type):
+        """Test that evenly spaced values digitize integer data like a search."""
+        step = colormap._get_uniform_step(values)
+        assert step is not None
+        info = np.iinfo(data_type)
+        data = np.unique(np.concatenate((np.linspace(info.min, info.max, 1000).astype(data_type),
+                                         np.clip(values, info.min, info.max).astype(data_type),
+                                         [info.min, info.max]))).astype(data_type)
+        np.testing.assert_array_equal(colormap._digitize_array(data, values, step),
+                                      colormap._digitize_array(data, values))
+
+    def test_uniform_step(self):
+        """Test the detection of evenly spaced values."""
+        assert colormap._get_uniform_step(np.array([1, 2, 3])) == 1
+        assert colormap._get_uniform_step(np.array([1, 2, 4])) is None
+        assert colormap._get_uniform_step(np.array([1])) is None
+
+    def test_palettize_values_changed_in_place(self):
+        """Test that palettizing uses the current values, also after they are changed in place."""
+        cmap = colormap.Colormap(values=np.array([0.0, 1.0, 2.0, 3.0]), colors=np.zeros((4, 3)))
+        data = np.array([3.0])
+        np.testing.assert_array_equal(cmap.palettize(data)[0], [3])
+        cmap.values[:] = [0.0, 5.0, 6.0, 7.0]
+        np.testing.assert_array_equal(cmap.palettize(data)[0], [0])
+        cmap.values[:] = [0.0, 1.0, 2.0, 3.0]
+        np.testing.assert_array_equal(cmap.palettize(data)[0], [3])
+
+    @pytest.mark.parametrize('colors', [COLORS_RGB1, COLORS_RGBA1])
+    def test_colorize_numpy_blocks(self, colors, monkeypatch):
+        """Test that colorizing with numpy block by block doesn't change the result."""
+        values = np.linspace(0.2, 0.5, colors.shape[0])
+        data = np.array([[0.0, 0.2, 0.25, 0.3], [0.45, 0.5, 0.7, np.nan]])
+        monkeypatch.setattr(colormap, '_get_interp_hcl', lambda: None)
+        expected = colormap.colorize(data, colors, values)
+        monkeypatch.setattr(colormap, 'NUMPY_BLOCK_SIZE', 3)
+        res = colormap.colorize(data, colors, values)
+        np.testing.assert_allclose(res, expected)
+
+    @pytest.mark.parametrize('dtype', [None, np.float32, np.float64])
+    def test_colorize_dtype(self, dtype):
+        """Test the data type of the colorized arrays."""
+        import dask.array as da
+        cmap = colormap.Colormap(values=np.linspace(0.2, 0.5, COLORS_RGBA1.shape[0]), colors=COLORS_RGBA1)
+        data = np.array([[0.0, 0.2, 0.25, 0.3], [0.45, 0.5, 0.7, np.nan]])
+        kwargs = {} if dtype is None else {'dtype': dtype}
+        expected_dtype = np.float32 if dtype is None else dtype
+        res = cmap.colorize(data, **kwargs)
+        assert res.dtype == expected_dtype
+        dask_res = cmap.colorize(da.from_array(data, chunks=2), **kwargs)
+        assert dask_res.dtype == expected_dtype
+        assert dask_res.compute().dtype == expected_dtype
+        np.testing.assert_allclose(res, cmap.colorize(data, dtype=np.float64), atol=1e-6)
+
+    @pytest.mark.parametrize('use_numba', [True, False])
+    def test_colorize_float16(self, use_numba, monkeypatch):
+        """Test colorizing to half precision floats, which the compiled kernel doesn't support."""
+        if use_numba:
+            pytest.importorskip('numba')
+        else:
+            monkeypatch.setattr(colormap, '_get_interp_hcl', lambda: None)
+        cmap = colormap.Colormap(values=np.linspace(0.2, 0.5, COLORS_RGBA1.shape[0]), colors=COLORS_RGBA1)
+        data = np.array([[0.0, 0.2, 0.25, 0.3], [0.45, 0.5, 0.7, np.nan]])
+        res = cmap.colorize(data, dtype=np.float16)
+        assert res.dtype == np.float16
+        np.testing.assert_allclose(res, cmap.colorize(data, dtype=np.float64), atol=1e-3)
+
+    @pytest.mark.parametrize(('num_values', 'dtype'), [(4, np.uint8), (256, np.uint8), (257, np.uint16)])
+    def test_palettize_dtype(self, num_values, dtype):
+        """Test that the palette indices are of the smallest fitting type."""
+        cmap = colormap.Colormap(values=np.linspace(0, 1, num_values), colors=np.zeros((num_values, 3)))
+        data = np.linspace(-0.5, 1.5, 100)
+        channels, _ = cmap.palettize(data)
+        assert channels.dtype == dtype
+        assert channels.max() == num_values - 1
+        cmap = colormap.Colormap(values=np.geomspace(1, 2, num_values), colors=np.zeros((num_values, 3)))
+        channels, _ = cmap.palettize(data + 1)
+        assert channels.dtype == dtype
+        assert channels.max() == num_values - 1
+
+    def test_colorize_numpy_no_warnings(self, monkeypatch):
+        """Test that colorizing with numpy doesn't warn about invalid values."""
+        import warnings
+        monkeypatch.setattr(colormap, '_get_interp_hcl', lambda: None)
+        data = np.linspace(-0.5, 1.5, 100)
+        with warnings.catch_warnings():
+            warnings.simplefilter('error')
+            res = colormap.rainbow.colorize(data)
+        assert not np.isnan(res).any()
+
+    def test_colorbar_rows(self):
+        """Test that all the rows of a colorbar and palettebar are the same."""
+        channels = colormap.colorbar(3, 5, colormap.rainbow)
+        assert channels.shape == (3, 3, 5)
+        np.testing.assert_allclose(channels[:, 0, :], colormap.rainbow.colorize(np.linspace(0, 1, 5)))
+        np.testing.assert_allclose(channels[:, 2, :], channels[:, 0, :])
+        channel, _ = colormap.palettebar(3, 5, colormap.rainbow)
+        assert channel.shape == (3, 5)
+        np.testing.assert_array_equal(channel[2], channel[0])
+
+    def test_reverse(self):
+        """Test that reversing keeps the values and assigns the colors to them in reverse order."""
+        cmap = colormap.Colormap(values=np.array([0.0, 0.3, 0.5, 1.0]), colors=COLORS_RGBA1.copy())
+        orig_values = cmap.values.copy()
+        expected = cmap.colorize(orig_values[::-1])
+        cmap.reverse()
+        np.testing.assert_array_equal(cmap.values, orig_values)
+        np.testing.assert_allclose(cmap.colorize(orig_values), expected, atol=1e-6)
+
+    def test_colorize_masked(self):
+        """Test that all the channels get the mask of the data."""
+        cmap = colormap.Colormap(values=np.linspace(0.2, 0.5, COLORS_RGBA1.shape[0]), colors=COLORS_RGBA1)
+        data = np.ma.array([[0.2, 0.3], [0.4, 0.5]], mask=[[False, True], [False, False]])
+        res = cmap.colorize(data)
+        assert isinstance(res, np.ma.MaskedArray)
+        expected_mask = np.broadcast_to(data.mask, res.shape)
+        np.testing.assert_array_equal(res.mask, expected_mask)
+        res[0, 0, 0] = np.ma.masked
+        assert not data.mask[0, 0]
+        res = cmap.colorize(np.ma.array([0.2, 0.3]))
+        assert res.mask is np.ma.nomask
+
+    @pytest.mark.parametrize(('channel_chunks', 'expected_chunks'), [(None, (4,)), (4, (4,)), (1, (1, 1, 1, 1))])
+    def test_colorize_dask_channel_chunks(self, channel_chunks, expected_chunks):
+        """Test chunking the channels of colorized dask arrays."""
+        import dask.array as da
+        cmap = colormap.Colormap(values=np.linspace(0.2, 0.5, COLORS_RGBA1.shape[0]), colors=COLORS_RGBA1)
+        data = np.array([[0.0, 0.2, 0.25, 0.3], [0.45, 0.5, 0.7, np.nan]])
+        res = cmap.colorize(da.from_array(data, chunks=2), channel_chunks=channel_chunks)
+        assert res.chunks == (expected_chunks, (2,), (2, 2))
+        np.testing.assert_allclose(res.compute(), cmap.colorize(data))
+
+    @pytest.mark.parametrize('channel_chunks', [0, -1])
+    def test_colorize_bad_channel_chunks(self, channel_chunks):
+        """Test that channel chunks smaller than one are refused."""
+        import dask.array as da
+        cmap = colormap.Colormap(values=np.linspace(0.2, 0.5, COLORS_RGBA1.shape[0]), colors=COLORS_RGBA1)
+        data = np.array([[0.0, 0.2, 0.25, 0.3], [0.45, 0.5, 0.7, np.nan]])
+        for arr in (data, da.from_array(data, chunks=2)):
+            with pytest.raises(ValueError, match="channel_chunks"):
+                cmap.colorize(arr, channel_chunks=channel_chunks)
+
+    @pytest.mark.parametrize('use_numba', [True, False])
+    def test_colorize_u8(self, use_numba, monkeypatch):
+        """Test colorizing directly to 8-bit colors."""
+        import dask.array as da
+        if use_numba:
+            pytest.importorskip('numba')
+        else:
+            monkeypatch.setattr(colormap, '_get_interp_hcl', lambda: None)
+        cmap = colormap.Colormap(values=np.linspace(0.2, 0.5, COLORS_RGBA1.shape[0]), colors=COLORS_RGBA1)
+        data = np.array([[0.0, 0.2, 0.25, 0.3], [0.45, 0.5, 0.7, np.nan]])
+        res = cmap.colorize_u8(data)
+        assert res.dtype == np.uint8
+        expected = np.rint(np.clip(cmap.colorize(data, dtype=np.float64), 0, 1) * 255)
+        valid = ~np.isnan(data)
+        np.testing.assert_array_equal(res[:, valid], expected[:, valid])
+        np.testing.assert_array_equal(res[:, ~valid], 0)
+        dask_res = colormap.colorize_u8(da.from_array(data, chunks=2), cmap.colors, cmap.values)
+        assert dask_res.dtype == np.uint8
+        np.testing.assert_array_equal(dask_res.compute(), res)
+
+    def test_fortran_ordered_data(self):
+        """Test colorizing and palettizing Fortran ordered data, without copying it."""
+        data = np.linspace(-0.1, 1.1, 30).reshape((5, 6))
+        fortran_data = np.asfortranarray(data)
+        assert colormap._get_flat_order(fortran_data) == 'F'
+        assert colormap._get_flat_order(data) == 'C'
+        np.testing.assert_array_equal(colormap.rainbow.colorize(fortran_data), colormap.rainbow.colorize(data))
+        np.testing.assert_array_equal(colormap.rainbow.palettize(fortran_data)[0],
+                                      colormap.rainbow.palettize(data)[0])
+        np.testing.assert_array_equal(colormap.rainbow.colorize(data.T),
+                                      colormap.rainbow.colorize(data).transpose(0, 2, 1))